@@ -1,9 +1,8 @@
 import streamlit as st
 import pandas as pd
 from src.utils import get_asset_ids, convert_columns_to_datetime, format_revenue_reporting, aggrid, plot_revenue_daily, \
-    convert_df
-from src.components.wholesale import get_physical_notifications, split_pns_df, get_MIDP, clean_MIDP, get_system_price, \
-    get_wholesale_revenue
+    convert_df, script_run_executor
+from src.components.wholesale import submit_wholesale_data, split_pns_df, clean_MIDP, get_wholesale_revenue
 from src.components.balancing_mechanism import get_BM_revenue
 from src.components.dfr import get_DFR_revenue, filter_dfr_bmu, get_bmu_dfr_dict, replace_units_with_site_names, \
     append_wholesale_to_dfr
@@ -39,30 +38,33 @@ st.title("Live BESS Fleet Dashboard :moneybag:")
 date = st.date_input(label='Select a date:', value=datetime.datetime.now().date())
 # read in all asset ids into df
 asset_ids_df = get_asset_ids()
+# immutable set of bmus requested from the PN stream and used as its cache key
+unique_bmus = tuple(sorted(asset_ids_df['BMU ID'].unique()))
+
+# the elexon and modo requests are independent of each other so fetch them concurrently, one worker per request
+with script_run_executor(max_workers=5) as ex:
+    # retrieve physical notifications, market index data price and system price for chosen settlement date from
+    # Elexon API
+    f_pns, f_midp, f_sys_price = submit_wholesale_data(executor=ex, start=date, end=date, bmus=unique_bmus)
+    # retrieve all bm bid-offer acceptances from Modo API
+    f_bm = ex.submit(get_BM_revenue, start=date, end=date)
+    # retrieve all dfr auction results from Modo/Grid API
+    f_dfr = ex.submit(get_DFR_revenue, start=date, end=date)
+
+    pns, midp, sys_price = f_pns.result(), f_midp.result(), f_sys_price.result()
+    grouped_by_bmu_bm_df = f_bm.result()
+    dfr_df = f_dfr.result()
 
-# retrieve all physical notifications from PN stream endpoint from Elexon API
-pns = get_physical_notifications(start=date, end=date, assets_df=asset_ids_df)
 cleaned_pns = convert_columns_to_datetime(df=pns, datetime_columns=['timeFrom', 'timeTo', 'settlementDate'],
-                                          datetime_formats=[None, None, "%Y-%m-%d"])
+                                          datetime_formats=["%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%d"])
 
-# retrieve market index data price for chosen settlement date from Elexon API
-midp = get_MIDP(start=date, end=date)
 clean_midp = clean_MIDP(df=midp, values='MIDP (£/MWh)', weights='Volume')
 
-# retrieve system price for chosen settlement date
-sys_price = get_system_price(start=date, end=date)
-
-# split physical notifications based on condition specified in function docstring
-eq_df, not_eq_df = split_pns_df(df=cleaned_pns, mid_price_df=clean_midp, sys_price_df=sys_price)
+# flag physical notifications based on condition specified in function docstring
+priced_pns = split_pns_df(df=cleaned_pns, mid_price_df=clean_midp, sys_price_df=sys_price)
 
 # wholesale revenues inferred
-wholesale_df, grouped_by_bmu_wholesale_df = get_wholesale_revenue(eq_df=eq_df, not_eq_df=not_eq_df)
-
-# bm revenues inferred
-grouped_by_bmu_bm_df = get_BM_revenue(start=date, end=date)
-
-# retrieve all dfr auction results from Modo/Grid API
-dfr_df = get_DFR_revenue(start=date, end=date)
+wholesale_df, grouped_by_bmu_wholesale_df = get_wholesale_revenue(df=priced_pns)
 
 dfr_bmu_df = filter_dfr_bmu(map_df=asset_ids_df, dfr_df=dfr_df)
 bmu_dict = get_bmu_dfr_dict(df=asset_ids_df)
@@ -70,11 +72,8 @@ grouped_by_unit_dfr_df = replace_units_with_site_names(df=dfr_bmu_df, dict_map=b
 
 # merge DFR revenues with Wholesale MIDP revenues
 revenue_df = append_wholesale_to_dfr(dfr_df=grouped_by_unit_dfr_df, wholesale_df=grouped_by_bmu_wholesale_df)
-revenue_df = revenue_df.loc[:,
-             ['Unit Name', 'BMU ID', 'Site', 'MW', 'MWh', 'EFA Date', 'Owner', 'Optimiser', 'DFR (£)',
-              'Wholesale MIDP (£)', 'Wholesale Sys (£)']]
 
-df_dfr_ws_bm = pd.merge(revenue_df, grouped_by_bmu_bm_df, on='BMU ID', how='left')
+df_dfr_ws_bm = revenue_df.join(grouped_by_bmu_bm_df.set_index('BMU ID'), on='BMU ID', how='left', validate='m:1')
 
 format_df = format_revenue_reporting(df=df_dfr_ws_bm)
 csv = convert_df(df=format_df)
@@ -87,29 +86,37 @@ st.sidebar.download_button(
     mime='text/csv',
 )
 st.sidebar.caption("""You can check out the source code [here](https://github.com/AkbarLutfullah/bess-leaderboard).""")
-with st.container():
-    st.success(f"Showing {len(format_df)} BMUs for {date}")
-    chart = st.checkbox(label='Show revenue chart', value=False,
-                        help='Display asset revenues in £/MW/yr from left to right')
-    switch = tog.st_toggle_switch(label="Mobile View",
-                                  key="Key1",
-                                  default_value=False,
-                                  label_after=False,
-                                  inactive_color='#D3D3D3',
-                                  active_color="#11567f",
-                                  track_color="#29B5E8"
-                                  )
-    if switch:
-        if chart:
-            rev_plot = plot_revenue_daily(df=format_df)
-            st.plotly_chart(rev_plot, use_container_width=True, config={'displaylogo': False})
-            st.table(format_df)
-        else:
-            st.table(format_df)
-    else:
-        if chart:
-            rev_plot = plot_revenue_daily(df=format_df)
-            st.plotly_chart(rev_plot, use_container_width=True, config={'displaylogo': False})
-            aggrid(df=format_df)
+
+
+# the view toggles only rerun this fragment, not the fetch and merge pipeline above
+@st.fragment
+def render_view(format_df: pd.DataFrame, date: datetime.date):
+    with st.container():
+        st.success(f"Showing {len(format_df)} BMUs for {date}")
+        chart = st.checkbox(label='Show revenue chart', value=False,
+                            help='Display asset revenues in £/MW/yr from left to right')
+        switch = tog.st_toggle_switch(label="Mobile View",
+                                      key="Key1",
+                                      default_value=False,
+                                      label_after=False,
+                                      inactive_color='#D3D3D3',
+                                      active_color="#11567f",
+                                      track_color="#29B5E8"
+                                      )
+        if switch:
+            if chart:
+                rev_plot = plot_revenue_daily(df=format_df)
+                st.plotly_chart(rev_plot, use_container_width=True, config={'displaylogo': False})
+                st.table(format_df)
+            else:
+                st.table(format_df)
         else:
-            aggrid(df=format_df)
+            if chart:
+                rev_plot = plot_revenue_daily(df=format_df)
+                st.plotly_chart(rev_plot, use_container_width=True, config={'displaylogo': False})
+                aggrid(df=format_df)
+            else:
+                aggrid(df=format_df)
+
+
+render_view(format_df=format_df, date=date)
@@ -1,19 +1,19 @@
 import os
-import sys
 import pandas as pd
-import requests
 import concurrent.futures
 import streamlit as st
 from dotenv import load_dotenv
 
 from src.logger import logger
-from src.exception import CustomException
+from src.utils import create_session
 
 # Load environment variables from .env file
 load_dotenv()
 
+_session = create_session()
 
-@st.cache_data(ttl=60, show_spinner="loading...")
+
+@st.cache_data(ttl="15m", max_entries=32, show_spinner="loading...")
 def get_BM_revenue(start: str, end: str, max_workers=12):
     """
     Get all detailed system prices from Modo API.
@@ -29,17 +29,26 @@ def get_BM_revenue(start: str, end: str, max_workers=12):
 
     try:
         logger.info(
-            f"Entered the Modo detailed system prices function, getting DETSYS for settlement date : {start}"
+            "Entered the Modo detailed system prices function, getting DETSYS for settlement date : %s",
+            start,
         )
+        # request page n+1 while page n is parsed
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            while url is not None:
-                future = executor.submit(requests.get, url, headers=headers)
+            future = executor.submit(_session.get, url, headers=headers)
+            while future is not None:
                 response = future.result()
                 response.raise_for_status()
-                df_list.append(pd.DataFrame(response.json()["results"]))
-                url = response.json()["next"]
+                js = response.json()
+                url = js["next"]
+                future = (
+                    executor.submit(_session.get, url, headers=headers)
+                    if url is not None
+                    else None
+                )
+                df_list.append(pd.DataFrame(js["results"]))
 
-        df = pd.concat(df_list)
+        # concatenate once and back the columns with arrow dtypes
+        df = pd.concat(df_list).convert_dtypes(dtype_backend="pyarrow")
         df_not_empty = len(df) > 0
         if df_not_empty:
             logger.info(
@@ -79,6 +88,6 @@ def get_BM_revenue(start: str, end: str, max_workers=12):
                 f"Error obtaining DETSYS from Modo API - please enter a valid date"
             )
 
-    except Exception as e:
-        logger.error("Error obtaining DETSYS from Modo API")
-        raise CustomException(e, sys)
+    except Exception:
+        logger.exception("Error obtaining DETSYS from Modo API")
+        raise
@@ -1,16 +1,16 @@
 import os
-import sys
 import pandas as pd
-import requests
 import concurrent.futures
 import streamlit as st
 from dotenv import load_dotenv
 
 from src.logger import logger
-from src.exception import CustomException
+from src.utils import create_session
 
+_session = create_session()
 
-@st.cache_data(ttl=60, show_spinner="loading...")
+
+@st.cache_data(ttl="15m", max_entries=32, show_spinner="loading...")
 def get_DFR_revenue(start: str, end: str, max_workers=12):
     """
     Get all detailed system prices from Modo API.
@@ -26,24 +26,31 @@ def get_DFR_revenue(start: str, end: str, max_workers=12):
 
     try:
         logger.info(
-            f"Entered the Modo dynamic frequency function, getting dfr auction results for settlement date : {start}"
+            "Entered the Modo dynamic frequency function, getting dfr auction results for settlement date : %s",
+            start,
         )
+        # request page n+1 while page n is parsed
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            while url is not None:
-                future = executor.submit(requests.get, url, headers=headers)
+            future = executor.submit(_session.get, url, headers=headers)
+            while future is not None:
                 response = future.result()
                 response.raise_for_status()
-                df_list.append(pd.DataFrame(response.json()["results"]))
-                url = response.json()["next"]
-
-        df = pd.concat(df_list)
+                js = response.json()
+                url = js["next"]
+                future = (
+                    executor.submit(_session.get, url, headers=headers)
+                    if url is not None
+                    else None
+                )
+                df_list.append(pd.DataFrame(js["results"]))
+
+        # concatenate once and back the columns with arrow dtypes
+        df = pd.concat(df_list).convert_dtypes(dtype_backend="pyarrow")
         df_not_empty = len(df) > 0
         if df_not_empty:
             logger.info(
                 "Successfully obtained detailed system prices from MODO 'response_reform' API endpoint"
             )
-            # convert values to num where relevant
-            df = df.apply(pd.to_numeric, errors="ignore")
             df.columns = [
                 "Company",
                 "Unit Name",
@@ -57,6 +64,9 @@ def get_DFR_revenue(start: str, end: str, max_workers=12):
                 "Technology Type",
                 "Cancelled",
             ]
+            # convert values to num where relevant
+            num_cols = ["Clearing Price", "Cleared Volume"]
+            df[num_cols] = df[num_cols].apply(pd.to_numeric, errors="coerce")
             subset = df.loc[
                 :,
                 [
@@ -82,9 +92,9 @@ def get_DFR_revenue(start: str, end: str, max_workers=12):
                 f"Error obtaining dynamic frequency response reform from Modo API - please enter a valid date"
             )
 
-    except Exception as e:
-        logger.error("Error obtaining DFR from Modo API")
-        raise CustomException(e, sys)
+    except Exception:
+        logger.exception("Error obtaining DFR from Modo API")
+        raise
 
 
 def filter_dfr_bmu(map_df: pd.DataFrame, dfr_df: pd.DataFrame):
@@ -112,30 +122,25 @@ def filter_dfr_bmu(map_df: pd.DataFrame, dfr_df: pd.DataFrame):
         st.error(f"Error finding BMUs in Grid's DFR dataset: {e}")
 
 
+@st.cache_data(show_spinner=False)
 def get_bmu_dfr_dict(df: pd.DataFrame):
     """
-    Iterate through the (bmu) asset ids mapping file and create a nested mapping dict
+    Index the (bmu) asset ids mapping file by DFR unit ID and create a nested mapping dict
     :param df: mapping file
     :return dict: where outer key is the DFR unit ID and value is nested dict. inner dict keys are 'site,
     'owner', 'optimiser', 'MW' 'MWh' and values are actual site, owner, optimiser, bmu ids, MW and MWhs.
     """
     try:
-        nested_dict = {}
-        for index, row in df.iterrows():
-            inner_dict = {
-                "BMU ID": row["BMU ID"],
-                "Site": row["Site"],
-                "Owner": row["Owner"],
-                "Optimiser": row["Optimiser"],
-                "MW": row["MW"],
-                "MWh": row["MWh"],
-            }
-            outer_key = row["DFR/FFR ID"]
-            if outer_key not in nested_dict:
-                nested_dict[outer_key] = {}
-            nested_dict[outer_key] = inner_dict
+        # keep the last row per DFR unit ID so the index is unique for orient='index'
+        nested_dict = (
+            df.drop_duplicates(subset="DFR/FFR ID", keep="last")
+            .set_index("DFR/FFR ID")[
+                ["BMU ID", "Site", "Owner", "Optimiser", "MW", "MWh"]
+            ]
+            .to_dict(orient="index")
+        )
         return nested_dict
-    except Excepion as e:
+    except Exception as e:
         st.error(
             f"Error creating dict where key is DFR ID and value is owner, optimiser, MW and MWhs: {e}"
         )
@@ -148,29 +153,12 @@ def replace_units_with_site_names(df: pd.DataFrame, dict_map: dict):
     :param df: DFR auction results from Grid
     :return df: Site names replace Unit IDs
     """
-    # create a list of site names if the bmu asset with DFR ID is present in the DFR df
+    # map each dfr unit onto its bmu, site, owner, optimiser and capacity details
     try:
-        sites_list = []
-        owner_list = []
-        optimiser_list = []
-        MW_list = []
-        MWh_list = []
-        bmus = []
-        for unit in df["Unit Name"].values:
-            for key in dict_map.keys():
-                if unit == key:
-                    sites_list.append(dict_map[key]["Site"])
-                    owner_list.append(dict_map[key]["Owner"])
-                    optimiser_list.append(dict_map[key]["Optimiser"])
-                    MW_list.append(dict_map[key]["MW"])
-                    MWh_list.append(dict_map[key]["MWh"])
-                    bmus.append(dict_map[key]["BMU ID"])
-        df["BMU ID"] = bmus
-        df["Site"] = sites_list
-        df["Owner"] = owner_list
-        df["Optimiser"] = optimiser_list
-        df["MW"] = MW_list
-        df["MWh"] = MWh_list
+        attributes = ["BMU ID", "Site", "Owner", "Optimiser", "MW", "MWh"]
+        # single hash lookup of every unit against the mapping rather than one dict build per attribute
+        mapping_df = pd.DataFrame.from_dict(dict_map, orient="index")[attributes]
+        df[attributes] = mapping_df.reindex(df["Unit Name"]).set_axis(df.index)
         df = df.rename(columns={"Revenue": "DFR (£)"})
         # sort by highest DFR revenue
         # df = df.sort_values(by='DFR (£)', ascending=False).reset_index(drop=True)
@@ -186,13 +174,13 @@ def append_wholesale_to_dfr(dfr_df: pd.DataFrame, wholesale_df: pd.DataFrame):
     :param wholesale_df: Wholesale MIDP revenue df
     :return df: combined revenues DF per settlement date
     """
-    combine_df = pd.merge(dfr_df, wholesale_df, on="Unit Name")
-    combine_df = combine_df.fillna(0)
-
-    # rearrange columns order
-    combine_df = combine_df.loc[
-        :,
-        [
+    revenue_cols = ["DFR (£)", "Wholesale MIDP (£)", "Wholesale Sys (£)"]
+    # each dfr unit row picks up at most one wholesale row, join against the wholesale index and
+    # rearrange columns order in the same expression
+    combine_df = dfr_df.join(
+        wholesale_df.set_index("Unit Name"), on="Unit Name", how="left", validate="m:1"
+    ).reindex(
+        columns=[
             "Unit Name",
             "BMU ID",
             "Site",
@@ -201,10 +189,10 @@ def append_wholesale_to_dfr(dfr_df: pd.DataFrame, wholesale_df: pd.DataFrame):
             "EFA Date",
             "Owner",
             "Optimiser",
-            "DFR (£)",
-            "Wholesale MIDP (£)",
-            "Wholesale Sys (£)",
-        ],
-    ]
+            *revenue_cols,
+        ]
+    )
+    # only the revenue columns need zero filling
+    combine_df[revenue_cols] = combine_df[revenue_cols].fillna(0)
 
     return combine_df
@@ -1,31 +1,49 @@
 import concurrent.futures
-import sys
 import os
 import io
 
 import pandas as pd
 import numpy as np
-import requests
 import streamlit as st
 
-from src.exception import CustomException
 from src.logger import logger
-from src.utils import get_wavg
+from src.utils import create_session, is_settled, REQUEST_TIMEOUT
 from dotenv import load_dotenv
-from ElexonDataPortal import api
 import datetime
 
 # Load environment variables from .env file
 load_dotenv()
 
+_ELEXON_API_KEY = os.environ.get("ELEXON_API_KEY")
+if _ELEXON_API_KEY is None:
+    logger.error("ELEXON_API_KEY is not set, system price requests will fail")
 
-@st.cache_data(ttl=60, show_spinner="loading...")
-def get_physical_notifications(
-    start: str, end: str, assets_df: pd.DataFrame
-) -> pd.DataFrame:
+_session = create_session(pool_connections=16, pool_maxsize=16)
+# ask the elexon stream endpoints for json, requests already negotiates compression via its default Accept-Encoding
+_JSON_HEADERS = {"Accept": "application/json"}
+# number of bmus requested per PN stream call
+_PN_BMU_CHUNK_SIZE = 50
+
+
+def _fetch_pn_chunk(url: str, bmus: list) -> pd.DataFrame:
+    """
+    Get fpn data for a chunk of bmus from the ELEXON PN stream endpoint.
+    :param url: PN stream url for the requested dates
+    :param bmus: BMU IDs to request
+    :return pd.DataFrame: pns for the chunk of bmus
+    """
+    response = _session.get(
+        url, params={"bmUnit": bmus}, headers=_JSON_HEADERS, timeout=REQUEST_TIMEOUT
+    )
+    response.raise_for_status()
+    return pd.DataFrame(response.json()).convert_dtypes(dtype_backend="pyarrow")
+
+
+def _fetch_physical_notifications(start: str, end: str, bmus: tuple) -> pd.DataFrame:
     """
-    Get fpn data for fleet from ELEXON API.
-    :param assets_df: df containing asset ids
+    Get fpn data for fleet from ELEXON API. The bmus are requested in chunks of _PN_BMU_CHUNK_SIZE concurrently so
+    large fleets stay within the endpoint's limits.
+    :param bmus: sorted tuple of unique BMU IDs, immutable so it can be hashed cheaply as the cache key
     :param start: Date from in request (YY-m-d)
     :param end: Date to in request (YY-m-d)
     :return pd.DataFrame: columns -> dataset, settlementDate, settlementPeriod, timeFrom, timeTo, levelFrom, levelTo,
@@ -36,40 +54,39 @@ def get_physical_notifications(
         logger.info(
             "Entered the physical notifications (pn) function, getting pns for all unique bmus"
         )
-        unique_bmus = assets_df["BMU ID"].unique().tolist()
-
-        params = {"bmUnit": unique_bmus}
         url = (
             f"https://data.elexon.co.uk/bmrs/api/v1/datasets/PN/stream?from={start}&to={end}&settlementPeriodFrom=1"
             f"&settlementPeriodTo=48 "
         )
-        with concurrent.futures.ThreadPoolExecutor(12) as executor:
-            # Submit requests to the ThreadPoolExecutor
-            future = executor.submit(requests.get, url, params=params)
-            response = future.result()
-            response.raise_for_status()
-            df = pd.DataFrame(response.json())
-            df_not_empty = len(df) > 0
-
-            if df_not_empty:
-                logger.info(
-                    "Successfully obtained pns from Elexon 'PN stream' API endpoint"
-                )
-
-                return df
-
-            else:
-                logger.info("Invalid request - user needs to choose a valid date")
-                st.error(
-                    f"Error obtaining PNs from Elexon API - please enter a valid date"
-                )
+        chunks = [
+            list(bmus[i : i + _PN_BMU_CHUNK_SIZE])
+            for i in range(0, len(bmus), _PN_BMU_CHUNK_SIZE)
+        ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            dfs = list(executor.map(lambda chunk: _fetch_pn_chunk(url, chunk), chunks))
 
-    except Exception as e:
-        logger.error("Error obtaining pns from Elexon 'PN stream' API endpoint")
-        raise CustomException(e, sys)
+        # chunks with no pns come back without any columns so leave them out of the concat
+        dfs = [chunk_df for chunk_df in dfs if len(chunk_df) > 0]
+        df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+        df_not_empty = len(df) > 0
 
+        if df_not_empty:
+            logger.info(
+                "Successfully obtained pns from Elexon 'PN stream' API endpoint"
+            )
 
-def get_MIDP(start: str, end: str) -> pd.DataFrame:
+            return df
+
+        else:
+            logger.info("Invalid request - user needs to choose a valid date")
+            st.error(f"Error obtaining PNs from Elexon API - please enter a valid date")
+
+    except Exception:
+        logger.exception("Error obtaining pns from Elexon 'PN stream' API endpoint")
+        raise
+
+
+def _fetch_MIDP(start: str, end: str) -> pd.DataFrame:
     """
     Get Market Index Price data for each sp from ELEXON API.
     :param start: start date inputted by user in st.date_input
@@ -81,52 +98,55 @@ def get_MIDP(start: str, end: str) -> pd.DataFrame:
 
     try:
         logger.info(
-            f"Entered the market index data price function, getting midp for settlement date: {start}"
+            "Entered the market index data price function, getting midp for settlement date: %s",
+            start,
         )
-        with concurrent.futures.ThreadPoolExecutor(12) as executor:
-            # Submit requests to the ThreadPoolExecutor
-            future = executor.submit(requests.get, url)
-            response = future.result()
-            response.raise_for_status()
-            js = response.json()
-            df = pd.DataFrame(js)
-            df_not_empty = len(df) > 0
-
-            if df_not_empty:
-                logger.info(
-                    "Successfully obtained market index price from Elexon 'MID/Stream' API endpoint"
-                )
-                df.columns = [
-                    "Dataset",
-                    "Timestamp",
+        response = _session.get(url, headers=_JSON_HEADERS, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        df = pd.DataFrame(response.json()).convert_dtypes(dtype_backend="pyarrow")
+        df_not_empty = len(df) > 0
+
+        if df_not_empty:
+            logger.info(
+                "Successfully obtained market index price from Elexon 'MID/Stream' API endpoint"
+            )
+            df.columns = [
+                "Dataset",
+                "Timestamp",
+                "provider",
+                "settlementDate",
+                "settlementPeriod",
+                "MIDP (£/MWh)",
+                "Volume",
+            ]
+            df = df.loc[
+                :,
+                [
                     "provider",
                     "settlementDate",
                     "settlementPeriod",
                     "MIDP (£/MWh)",
                     "Volume",
-                ]
-                df = df.loc[
-                    :,
-                    [
-                        "provider",
-                        "settlementDate",
-                        "settlementPeriod",
-                        "MIDP (£/MWh)",
-                        "Volume",
-                    ],
-                ]
-                df = df.apply(pd.to_numeric, errors="ignore")
-
-                return df
-            else:
-                logger.info("Invalid request - user needs to choose a valid date")
-                st.error(
-                    f"Error obtaining market index price from Elexon API - please enter a valid date"
-                )
+                ],
+            ]
+            df = df.astype(
+                {
+                    "settlementPeriod": "int16",
+                    "MIDP (£/MWh)": "float32",
+                    "Volume": "float32",
+                }
+            )
 
-    except Exception as e:
-        logger.error("Error obtaining MIDP from Elexon 'MID/Stream'' API endpoint")
-        raise CustomException(e, sys)
+            return df
+        else:
+            logger.info("Invalid request - user needs to choose a valid date")
+            st.error(
+                f"Error obtaining market index price from Elexon API - please enter a valid date"
+            )
+
+    except Exception:
+        logger.exception("Error obtaining MIDP from Elexon 'MID/Stream'' API endpoint")
+        raise
 
 
 def clean_MIDP(df: pd.DataFrame, values: str, weights: str) -> pd.DataFrame:
@@ -141,37 +161,33 @@ def clean_MIDP(df: pd.DataFrame, values: str, weights: str) -> pd.DataFrame:
     :return pd.DataFrame: columns -> settlementPeriod, MIDP (£/MWh)
     """
     try:
-        df = (
-            df.groupby("settlementPeriod")
-            .apply(get_wavg, values=values, weights=weights)
-            .reset_index()
-        )
+        # weighted average per sp as two vectorised groupby sums rather than a python callback per group
+        num = (df[values] * df[weights]).groupby(df["settlementPeriod"]).sum()
+        den = df.groupby("settlementPeriod")[weights].sum()
+        df = (num / den).reset_index()
         df.columns = ["settlementPeriod", "MIDP (£/MWh)"]
         return df
     except Exception as e:
         st.error(f"Error when finding weighted average of MIDP: {e}")
 
 
-@st.cache_data(ttl=60, show_spinner="loading...")
-def get_system_price(start: str, end: str) -> pd.DataFrame:
+def _fetch_system_price(start: str, end: str) -> pd.DataFrame:
     """
     Get System Price data for each sp from ELEXON API.
     :param start: Date from in request (YY-m-d)
     :param end: Date to in request (YY-m-d)
     :return pd.DataFrame: columns -> settlementPeriod, Sys Price (£/MWh)
     """
-    APIKey = os.environ.get("ELEXON_API_KEY")
-
     try:
         logger.info(
-            f"Entered the system price data function, getting system price for settlement date: {start}"
+            "Entered the system price data function, getting system price for settlement date: %s",
+            start,
         )
-        url = f"https://api.bmreports.com/BMRS/DERSYSDATA/v1?APIKey={APIKey}&FromSettlementDate={start}&ToSettlementDate={end}&ServiceType=csv"
-        r = requests.get(url)
+        url = f"https://api.bmreports.com/BMRS/DERSYSDATA/v1?APIKey={_ELEXON_API_KEY}&FromSettlementDate={start}&ToSettlementDate={end}&ServiceType=csv"
+        r = _session.get(url, timeout=REQUEST_TIMEOUT)
         r.raise_for_status()
-        urlData = r.content
-
-        rawData = pd.read_csv(io.StringIO(urlData.decode("utf-8")))
+        # parse the csv bytes directly rather than decoding to a str copy first
+        rawData = pd.read_csv(io.BytesIO(r.content), encoding="utf-8")
         rawData = rawData.reset_index()
         df_not_empty = len(rawData) > 0
 
@@ -192,57 +208,188 @@ def get_system_price(start: str, end: str) -> pd.DataFrame:
                 f"Error obtaining system price from Elexon API - please enter a valid date"
             )
 
-    except Exception as e:
-        logger.error(
+    except Exception:
+        logger.exception(
             "Error obtaining system price from Elexon 'DERSYSDATA' API endpoint"
         )
-        raise CustomException(e, sys)
+        raise
+
+
+class _NoSettledData(Exception):
+    """Raised inside the disk persisted wrappers so a failed or empty fetch is never written to the cache"""
+
+
+def _require_data(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pass a fetched frame through to the persisted cache, raising when there is nothing worth keeping.
+    :param df: result of one of the _fetch_* functions, None when the request failed or returned no rows
+    :return pd.DataFrame: the same frame
+    """
+    if df is None or df.empty:
+        raise _NoSettledData
+    return df
+
+
+# recent settlement periods are still being published so are only cached for a short ttl, whereas settled dates
+# are immutable and persisted to disk so they survive app restarts
+@st.cache_data(ttl="5m", max_entries=64, show_spinner="loading...")
+def _get_live_physical_notifications(start: str, end: str, bmus: tuple) -> pd.DataFrame:
+    return _fetch_physical_notifications(start=start, end=end, bmus=bmus)
+
+
+@st.cache_data(persist="disk", max_entries=512, show_spinner="loading...")
+def _get_settled_physical_notifications(
+    start: str, end: str, bmus: tuple
+) -> pd.DataFrame:
+    return _require_data(_fetch_physical_notifications(start=start, end=end, bmus=bmus))
+
+
+@st.cache_data(ttl="15m", max_entries=32, show_spinner="loading...")
+def _get_live_MIDP(start: str, end: str) -> pd.DataFrame:
+    return _fetch_MIDP(start=start, end=end)
+
+
+@st.cache_data(persist="disk", max_entries=512, show_spinner="loading...")
+def _get_settled_MIDP(start: str, end: str) -> pd.DataFrame:
+    return _require_data(_fetch_MIDP(start=start, end=end))
+
+
+@st.cache_data(ttl="15m", max_entries=32, show_spinner="loading...")
+def _get_live_system_price(start: str, end: str) -> pd.DataFrame:
+    return _fetch_system_price(start=start, end=end)
+
+
+@st.cache_data(persist="disk", max_entries=512, show_spinner="loading...")
+def _get_settled_system_price(start: str, end: str) -> pd.DataFrame:
+    return _require_data(_fetch_system_price(start=start, end=end))
+
+
+def _dispatch(end: str, live_fn, settled_fn, *args) -> pd.DataFrame:
+    """
+    Route a fetch to the disk persisted cache once its settlement date is final, otherwise to the short ttl cache.
+    :param end: Date to in request (YY-m-d), decides which cache is used
+    :param live_fn: ttl cached wrapper used for dates that may still change
+    :param settled_fn: disk persisted wrapper used for settled dates
+    :param args: arguments passed through to the wrapper
+    :return pd.DataFrame: the wrapper's result, None when the fetch failed or returned no rows
+    """
+    if is_settled(end):
+        try:
+            return settled_fn(*args)
+        except _NoSettledData:
+            # the fetch has already logged and shown the error, leave it uncached so the next run retries
+            return None
+    return live_fn(*args)
+
+
+def get_physical_notifications(start: str, end: str, bmus: tuple) -> pd.DataFrame:
+    """
+    Get fpn data for fleet from ELEXON API, cached on disk once the settlement date is final.
+    :param start: Date from in request (YY-m-d)
+    :param end: Date to in request (YY-m-d)
+    :param bmus: sorted tuple of unique BMU IDs
+    :return pd.DataFrame: see _fetch_physical_notifications
+    """
+    return _dispatch(
+        end,
+        _get_live_physical_notifications,
+        _get_settled_physical_notifications,
+        start,
+        end,
+        bmus,
+    )
+
+
+def get_MIDP(start: str, end: str) -> pd.DataFrame:
+    """
+    Get Market Index Price data for each sp from ELEXON API, cached on disk once the settlement date is final.
+    :param start: start date inputted by user in st.date_input
+    :param end: end date inputted by user in st.date_input
+    :return pd.DataFrame: see _fetch_MIDP
+    """
+    return _dispatch(end, _get_live_MIDP, _get_settled_MIDP, start, end)
+
+
+def get_system_price(start: str, end: str) -> pd.DataFrame:
+    """
+    Get System Price data for each sp from ELEXON API, cached on disk once the settlement date is final.
+    :param start: Date from in request (YY-m-d)
+    :param end: Date to in request (YY-m-d)
+    :return pd.DataFrame: see _fetch_system_price
+    """
+    return _dispatch(end, _get_live_system_price, _get_settled_system_price, start, end)
+
+
+def submit_wholesale_data(
+    executor: concurrent.futures.Executor, start: str, end: str, bmus: tuple
+) -> tuple:
+    """
+    Submit the physical notifications, market index price and system price fetches from ELEXON API to the caller's
+    executor, since the three requests are independent of each other and of the other API calls.
+    :param executor: pool shared with the caller's other fetches, sized to include these three
+    :param start: Date from in request (YY-m-d)
+    :param end: Date to in request (YY-m-d)
+    :param bmus: sorted tuple of unique BMU IDs
+    :return tuple: futures of the pns df, midp df and system price df
+    """
+    f_pn = executor.submit(get_physical_notifications, start=start, end=end, bmus=bmus)
+    f_midp = executor.submit(get_MIDP, start=start, end=end)
+    f_sys_price = executor.submit(get_system_price, start=start, end=end)
+
+    return f_pn, f_midp, f_sys_price
 
 
 def split_pns_df(
     df: pd.DataFrame, mid_price_df: pd.DataFrame, sys_price_df: pd.DataFrame
 ) -> pd.DataFrame:
     """
-    Split physical notifications (PNs) into 'Equal' and 'Not Equal'. When the 'levelFrom' and 'levelTo' columns are equal, the MIDP is multiplied
-    by the 'levelFrom' volume for Wholesale revenue calculation. This is marked by the variable 1 in the 'Equal' column.
+    Flag physical notifications (PNs) as 'Equal' or 'Not Equal' and derive the volume used for revenue. When the
+    'levelFrom' and 'levelTo' columns are equal, the MIDP is multiplied by the 'levelFrom' volume for Wholesale revenue
+    calculation. This is marked by the variable 1 in the 'Equal' column.
     When the 'levelFrom' and 'levelTo' columns are not equal for a BMU in a settlement period then that implies the
     volume pn-ed has changed during the half hour settlement period. To calculate the subsequent wholesale revenue,
-    the net pn-ed volume is calculated in a separate column 'Net PN' and this throughput is multiplied by MIDP to
-    calculate revenue.
+    the net pn-ed volume is used instead. Both cases are held in the 'Net PN' column so the revenue can be computed in
+    a single pass without splitting the df.
     :param sys_price_df: df containing system price per settlement period
     :param mid_price_df: df containing market index data price per settlement period
-    :param df: dataframe containing physical notifications that need to be split
-    :return eq_df (pd.DataFrame): columns -> dataset, settlementDate, settlementPeriod, timeFrom, timeTo, levelFrom, levelTo,
-                                    nationalGridBmUnit, bmUnit, MIDP (£/MWh), Sys Price (£/MWh), Hours, Equal
-            not_eq_df (pd.DataFrame): same as eq_df with the addition of the NET PN column at the end
+    :param df: dataframe containing physical notifications
+    :return pd.DataFrame: columns -> dataset, settlementDate, settlementPeriod, timeFrom, timeTo, levelFrom, levelTo,
+                                    nationalGridBmUnit, bmUnit, MIDP (£/MWh), Sys Price (£/MWh), Hours, Equal, Net PN
     """
 
     try:
         logger.info(
-            f"Entered the split physical notifications function, splitting physical notifications"
+            "Entered the split physical notifications function, flagging physical notifications"
         )
-        # merge the midp onto the pns so now each row has a unique price per sp
-        df = pd.merge(df, mid_price_df, on="settlementPeriod")
-        # then merge sys price onto same df
-        df = pd.merge(df, sys_price_df, on="settlementPeriod")
-
-        df = df.fillna(0)
-
-        # find timedelta
-        df["Hours"] = (df["timeTo"] - df["timeFrom"]).dt.seconds / 3600
-
-        df["Equal"] = np.where(df["levelFrom"] == df["levelTo"], 1, 0)
-
-        not_eq_df = df[df["Equal"] == 0]
-        eq_df = df[df["Equal"] == 1]
-
-        # if levels aren't equal then sum the levels to get net throughput
-        not_eq_df["Net PN"] = not_eq_df["levelFrom"] + not_eq_df["levelTo"]
-        dfs_not_empty = len(eq_df) > 0 and len(not_eq_df) > 0
+        # map the midp onto the pns so now each row has a unique price per sp
+        midp_s = mid_price_df.set_index("settlementPeriod")["MIDP (£/MWh)"]
+        # then map sys price onto same df
+        sys_s = sys_price_df.set_index("settlementPeriod")["Sys Price (£/MWh)"]
+
+        # find timedelta, a NaT timestamp gives NaN hours rather than a garbage int64 difference
+        hours = (df["timeTo"] - df["timeFrom"]).dt.total_seconds() / 3600
+
+        level_from = df["levelFrom"].to_numpy()
+        level_to = df["levelTo"].to_numpy()
+        equal = level_from == level_to
+
+        # add every derived column in a single assign so the pns are copied once
+        df = df.assign(
+            **{
+                # only the mapped prices can be missing, zero fill those rather than the whole df
+                "MIDP (£/MWh)": df["settlementPeriod"].map(midp_s).fillna(0),
+                "Sys Price (£/MWh)": df["settlementPeriod"].map(sys_s).fillna(0),
+                "Hours": hours,
+                "Equal": np.where(equal, 1, 0),
+                # if levels aren't equal then sum the levels to get net throughput
+                "Net PN": np.where(equal, level_from, level_from + level_to),
+            }
+        )
+        df_not_empty = len(df) > 0
 
-        if dfs_not_empty:
+        if df_not_empty:
             logger.info(
-                "Successfully split physical notifications dataframe into equal and not equal components"
+                "Successfully flagged physical notifications dataframe as equal and not equal"
             )
 
         else:
@@ -251,14 +398,14 @@ def split_pns_df(
                 f"Error splitting physical notifications into components - please enter a valid date"
             )
 
-        return eq_df, not_eq_df
+        return df
 
-    except Exception as e:
-        logger.error("Error splitting physical notifications into components")
-        raise CustomException(e, sys)
+    except Exception:
+        logger.exception("Error splitting physical notifications into components")
+        raise
 
 
-def get_wholesale_revenue(eq_df: pd.DataFrame, not_eq_df: pd.DataFrame) -> pd.DataFrame:
+def get_wholesale_revenue(df: pd.DataFrame) -> pd.DataFrame:
     """
     Return wholesale revenue across each asset.
     If the levelFrom equals levelTo:
@@ -266,35 +413,24 @@ def get_wholesale_revenue(eq_df: pd.DataFrame, not_eq_df: pd.DataFrame) -> pd.Da
     If the levelFrom is not equal to levelTo:
         calculate the timedelta between timeFrom and timeTo and multiply by MIDP and NET PN between levelFrom and
         levelTo
-    :param eq_df: PNs df where the levels are equal
-    :param not_eq_df: PNs df where the levels are not equal
+    :param df: PNs df with the 'Net PN' column from split_pns_df
     :return pd.DataFrame: columns -> bmu unit id (Unit Name), Wholesale MIDP (£), Wholesale Sys (£)
     """
-    eq_df["Wholesale MIDP (£)"] = (
-        eq_df["levelFrom"] * eq_df["Hours"] * eq_df["MIDP (£/MWh)"]
+    # assign onto a new frame rather than writing into the caller's df
+    df = df.assign(
+        **{
+            "Wholesale MIDP (£)": df["Net PN"] * df["Hours"] * df["MIDP (£/MWh)"],
+            "Wholesale Sys (£)": df["Net PN"] * df["Hours"] * df["Sys Price (£/MWh)"],
+        }
     )
-    eq_df["Wholesale Sys (£)"] = (
-        eq_df["levelFrom"] * eq_df["Hours"] * eq_df["Sys Price (£/MWh)"]
-    )
-
-    not_eq_df["Wholesale MIDP (£)"] = (
-        not_eq_df["Net PN"] * not_eq_df["Hours"] * not_eq_df["MIDP (£/MWh)"]
-    )
-    not_eq_df["Wholesale Sys (£)"] = (
-        not_eq_df["Net PN"] * not_eq_df["Hours"] * not_eq_df["Sys Price (£/MWh)"]
-    )
-
-    # combine both dfs into final wholesale
-    wholesale_df = pd.concat([eq_df, not_eq_df]).reset_index(drop=True).fillna(0)
 
-    # group results by asset
+    # group results by asset on a narrow frame holding only the key and the two revenue columns
     grouped_wholesale = (
-        wholesale_df.groupby("nationalGridBmUnit")[
-            ["Wholesale MIDP (£)", "Wholesale Sys (£)"]
-        ]
+        df[["nationalGridBmUnit", "Wholesale MIDP (£)", "Wholesale Sys (£)"]]
+        .groupby("nationalGridBmUnit", sort=False, observed=True)
         .sum()
         .reset_index()
     )
     grouped_wholesale.columns = ["Unit Name", "Wholesale MIDP (£)", "Wholesale Sys (£)"]
 
-    return wholesale_df, grouped_wholesale
+    return df, grouped_wholesale
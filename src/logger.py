@@ -1,9 +1,9 @@
 import logging
 import os
-from datetime import datetime
+from logging.handlers import RotatingFileHandler
 
-# create log file
-LOG_FILE = f"{datetime.now().strftime('%m_%d_%Y_%H_%M_%S')}.log"
+# create log file, rotated so the log dir doesn't grow without bound
+LOG_FILE = "app.log"
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
 LOG_FILE_PATH = os.path.join(LOG_DIR, LOG_FILE)
 
@@ -17,15 +17,20 @@ os.makedirs(LOG_DIR, exist_ok=True)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
+logger.propagate = False
 
 # create formatter
 formatter = logging.Formatter(
     "[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s"
 )
 
-# create file handler
-file_handler = logging.FileHandler(LOG_FILE_PATH)
-file_handler.setFormatter(formatter)
+# streamlit re-executes modules on rerun, only attach the file handler once
+if not logger.handlers:
+    # create file handler
+    file_handler = RotatingFileHandler(
+        LOG_FILE_PATH, maxBytes=10 * 1024 * 1024, backupCount=5
+    )
+    file_handler.setFormatter(formatter)
 
-# add file handler to logger
-logger.addHandler(file_handler)
+    # add file handler to logger
+    logger.addHandler(file_handler)
@@ -1,20 +1,126 @@
 import os
+import datetime
+import tempfile
+import threading
+import concurrent.futures
+from functools import lru_cache
+from zoneinfo import ZoneInfo
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import requests
 import streamlit as st
-from typing import List, Union
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import List
 from st_aggrid import AgGrid, ColumnsAutoSizeMode, JsCode
 from st_aggrid.grid_options_builder import GridOptionsBuilder
 import plotly_express as px
 
+from src.logger import logger
+
+# (connect, read) timeout in seconds for api requests
+REQUEST_TIMEOUT = (5, 30)
+
+
+def create_session(
+    pool_connections: int = 8, pool_maxsize: int = 16
+) -> requests.Session:
+    """
+    Create a requests session with a pooled https adapter so connections to the Elexon and Modo APIs are kept
+    alive between calls, retrying transient gateway errors
+    :param pool_connections: number of host connection pools to cache
+    :param pool_maxsize: maximum number of connections to keep per pool
+    :return session: session to be created once at module level and reused for every request
+    """
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+        ),
+    )
+
+    return session
+
+
+def script_run_executor(max_workers: int) -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Create a thread pool whose worker threads carry the current streamlit script run context, so st.error and the
+    cache spinners called from the workers still reach the page
+    :param max_workers: number of worker threads
+    :return executor: thread pool executor
+    """
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers,
+        initializer=add_script_run_ctx,
+        initargs=(None, get_script_run_ctx()),
+    )
+
+
+def is_settled(date) -> bool:
+    """
+    Check whether a settlement date is final, after which its market data no longer changes. Settlement days run
+    on UK local time and the last periods of a day can still be published the morning after, so a day's margin is
+    left on top of the Europe/London date
+    :param date: settlement date
+    :return bool: True if the date is before yesterday in Europe/London
+    """
+    today = datetime.datetime.now(ZoneInfo("Europe/London")).date()
+    return pd.Timestamp(date).date() < today - datetime.timedelta(days=1)
+
+
+# each streamlit session runs its script in its own thread, the lock makes the first load single flight so
+# concurrent sessions at cold start don't all build the sidecar
+_ASSET_IDS_LOCK = threading.Lock()
+
 
 def get_asset_ids() -> pd.DataFrame:
     """
-    Retrieve xlsx containing all asset IDS for BM and DFR
+    Retrieve xlsx containing all asset IDS for BM and DFR. The xlsx is converted to a parquet sidecar on first load
+    which is read instead while it is newer than the xlsx
     :return df: columns:
                 site, owner, optimiser, bmu id, dfr/ffr id, mw, mwh
     """
-    file_path = os.path.join(os.path.dirname(__file__), "..", "data", "asset_ids.xlsx")
+    with _ASSET_IDS_LOCK:
+        return _load_asset_ids()
+
+
+# zero-argument reference data loader, a process level lru_cache hit is a pointer check rather than a hashed
+# streamlit cache lookup
+@lru_cache(maxsize=1)
+def _load_asset_ids() -> pd.DataFrame:
+    data_dir = os.path.join(os.path.dirname(__file__), "..", "data")
+    file_path = os.path.join(data_dir, "asset_ids.xlsx")
+    parquet_path = os.path.join(data_dir, "asset_ids.parquet")
+
+    parquet_is_fresh = os.path.exists(parquet_path) and os.path.getmtime(
+        parquet_path
+    ) >= os.path.getmtime(file_path)
+    if parquet_is_fresh:
+        try:
+            return pd.read_parquet(parquet_path)
+        except Exception as e:
+            logger.warning(
+                "Could not read asset ids parquet, rebuilding from xlsx: %s", e
+            )
+
     df = pd.read_excel(file_path, sheet_name="bess bm")
+    # write to a temp file in the same dir and swap it in, so a reader never sees a half written sidecar
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=data_dir, suffix=".parquet.tmp")
+        os.close(fd)
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+    except Exception as e:
+        logger.warning("Could not write asset ids parquet, reading xlsx only: %s", e)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
     return df
 
@@ -34,30 +140,37 @@ def convert_columns_to_datetime(
             datetime_formats = [None] * len(datetime_columns)
 
         for col, fmt in zip(datetime_columns, datetime_formats):
-            df[col] = pd.to_datetime(df[col], format=fmt)
+            s = df[col]
+            # columns already in datetime format don't need re-parsing
+            if not pd.api.types.is_datetime64_any_dtype(s):
+                parsed = pd.to_datetime(s, format=fmt, cache=True, errors="coerce")
+                # a strict format coerces any upstream layout change (e.g. fractional seconds) to NaT, so reparse
+                # the column as generic ISO 8601 rather than silently dropping those rows from the revenue sums
+                if fmt is not None and (parsed.isna() & s.notna()).any():
+                    parsed = pd.to_datetime(
+                        s, format="ISO8601", cache=True, errors="coerce"
+                    )
+                n_coerced = int((parsed.isna() & s.notna()).sum())
+                if n_coerced:
+                    logger.warning(
+                        "%d values in %s could not be parsed as datetimes",
+                        n_coerced,
+                        col,
+                    )
+                    st.warning(
+                        f"{n_coerced} {col} values could not be read, revenues for those rows are excluded"
+                    )
+                df[col] = parsed
     except Exception as e:
         st.error(f"Error converting columns to date time - {e}")
 
     return df
 
 
-def get_wavg(df: pd.DataFrame, values: str, weights: str) -> Union[float, pd.DataFrame]:
-    """
-    Get weighted average
-    :param df: dataFrame containing the values and weights columns
-    :param values: column name containing the values to compute the weighted average
-    :param weights: column name containing the weights for the weighted average computation
-    :return: weighted average of the specified values column.
-    """
-    d = df[values]
-    w = df[weights]
-    return (d * w).sum() / w.sum()
-
-
 def format_revenue_reporting(df: pd.DataFrame):
     """
     Add formatting changes to leaderboard table:
-    - fill NA with 0s in BM
+    - fill NA with 0s in numeric columns and blanks in text columns
     - remove dps
     - add total column
     - report in £/MW/Yr
@@ -65,16 +178,27 @@ def format_revenue_reporting(df: pd.DataFrame):
     :param df: revenue df
     :return: revenue df
     """
-    clean_df = df.fillna(0)
     float_cols = ["DFR (£)", "Wholesale MIDP (£)", "Wholesale Sys (£)", "BM (£)"]
-    clean_df[float_cols] = clean_df[float_cols].astype(int)
+    # only numeric columns take a 0, an unmatched site keeps blank text columns so each column holds a single type
+    num_cols = df.select_dtypes(include="number").columns.union(float_cols)
+    text_cols = df.select_dtypes(include=["object", "string"]).columns.difference(
+        num_cols
+    )
+    clean_df = df.fillna(dict.fromkeys(num_cols, 0) | dict.fromkeys(text_cols, ""))
+    clean_df[float_cols] = clean_df[float_cols].astype("int32")
 
-    clean_df["Total (£)"] = (
-        clean_df["DFR (£)"] + clean_df["Wholesale MIDP (£)"] + clean_df["BM (£)"]
+    # system price wholesale revenue is excluded from the total
+    total = (
+        clean_df[["DFR (£)", "Wholesale MIDP (£)", "BM (£)"]]
+        .sum(axis=1)
+        .astype("int32")
     )
-    clean_df["k/MW/yr"] = (clean_df["Total (£)"] * 365) / (clean_df["MW"] * 1000)
+    k_per_mw = (total.to_numpy(dtype="float32") * 365.0) / (
+        clean_df["MW"].to_numpy(dtype="float32") * 1000.0
+    )
+    clean_df = clean_df.assign(**{"Total (£)": total, "k/MW/yr": k_per_mw})
     clean_df = clean_df.sort_values(by="k/MW/yr", ascending=False)
-    clean_df["k/MW/yr"] = clean_df["k/MW/yr"].astype(int)
+    clean_df["k/MW/yr"] = clean_df["k/MW/yr"].astype("int32")
     clean_df = clean_df.reset_index(drop=True)
     clean_df = clean_df.iloc[:, 2:]
     clean_df = clean_df.loc[
@@ -146,7 +270,20 @@ def plot_revenue_daily(df: pd.DataFrame):
     return fig
 
 
-@st.cache_data(show_spinner="loading...")
+@st.cache_data(
+    show_spinner="loading...",
+    hash_funcs={
+        pd.DataFrame: lambda d: int(pd.util.hash_pandas_object(d, index=True).sum())
+    },
+)
 def convert_df(df):
     # IMPORTANT: Cache the conversion to prevent computation on every rerun
-    return df.to_csv().encode("utf-8")
+    # the leaderboard index is a plain range so is left out of the csv
+    try:
+        buf = pa.BufferOutputStream()
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+        return buf.getvalue().to_pybytes()
+    except (pa.ArrowException, TypeError, ValueError) as e:
+        # arrow needs one type per column, fall back to pandas rather than losing the page
+        logger.warning("Arrow csv encoding failed, using pandas to_csv: %s", e)
+        return df.to_csv(index=False).encode("utf-8")